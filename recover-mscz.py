@@ -25,41 +25,175 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
+from collections import deque
 from pathlib import Path
-import subprocess
+import multiprocessing
 import zipfile
 import shutil
+import math
 import struct
+import time
+import sys
 import re
 import os
 
 import logging as log
 
+try:
+    # unix only: used for the BLKGETSIZE64 ioctl in get_disk_size()
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    # optional: vectorized signature scanning, see find_signature()
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # optional: SIMD multi-literal scanning, see find_signature()
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    # optional: JIT compilation of the candidate verifier, see verify_ecd()
+    import numba
+except ImportError:
+    numba = None
+
 __version__ = '0.1'
 
+# precompiled record formats and cached zipfile constants: the scan runs
+# once per candidate over billions of bytes, so don't re-parse format
+# strings or chase module attributes in there
+_FH = struct.Struct(zipfile.structFileHeader)
+
+_SIG_ECD = zipfile.stringEndArchive
+_SIG_FH = zipfile.stringFileHeader
+_SIZE_ECD = zipfile.sizeEndCentDir
+_SIZE_FH = zipfile.sizeFileHeader
+
+_FH_FILENAME_LENGTH = zipfile._FH_FILENAME_LENGTH
+
+
+def verify_ecd(buffer, i):
+    """Return the archive size for the EOCD record at offset i, or -1.
+
+    A record qualifies when it holds exactly 3 entries (container.xml,
+    title.mscx and thumbnail.png, which is how MuseScore writes its
+    zips) and carries no archive comment. Written with plain byte
+    indexing so numba can compile it to native code when available.
+    """
+    if i + _SIZE_ECD > len(buffer):
+        return -1
+
+    # exactly 3 entries, both on this disk and in total
+    if (buffer[i + 8] != 3 or buffer[i + 9] != 0 or
+            buffer[i + 10] != 3 or buffer[i + 11] != 0):
+        return -1
+
+    # no archive comment
+    if buffer[i + 20] != 0 or buffer[i + 21] != 0:
+        return -1
+
+    cd_size = (buffer[i + 12] | (buffer[i + 13] << 8) |
+               (buffer[i + 14] << 16) | (buffer[i + 15] << 24))
+    cd_offset = (buffer[i + 16] | (buffer[i + 17] << 8) |
+                 (buffer[i + 18] << 16) | (buffer[i + 19] << 24))
+
+    return cd_size + cd_offset + _SIZE_ECD
+
+
+if numba is not None:
+    verify_ecd = numba.njit(cache=True)(verify_ecd)
+
+# lazily compiled hyperscan databases, one per signature
+_hs_databases = {}
+
+
+def _get_hs_database(signature):
+    db = _hs_databases.get(signature)
+    if db is None:
+        db = hyperscan.Database()
+        db.compile(
+            # escape every byte so the signature is matched literally
+            expressions=[b''.join(b'\\x%02x' % b for b in signature)],
+            ids=[0],
+            flags=[hyperscan.HS_FLAG_SOM_LEFTMOST]
+        )
+        _hs_databases[signature] = db
+    return db
+
+
+def find_signature(buffer, signature):
+    """Yield the offsets of all occurrences of signature in buffer."""
+
+    if hyperscan is not None:
+        matches = []
+
+        def on_match(id_, start, end, flags, context):
+            matches.append(start)
+
+        _get_hs_database(signature).scan(
+            buffer, match_event_handler=on_match
+        )
+
+        yield from sorted(matches)
+        return
+
+    if np is not None and len(buffer) > len(signature):
+        # prefilter with SIMD-width byte compares: one streaming pass over a
+        # zero-copy view of the buffer, no per-byte Python overhead
+        arr = np.frombuffer(buffer, dtype=np.uint8)
+
+        mask = arr[:1 - len(signature)] == signature[0]
+        for n, byte in enumerate(signature[1:], start=1):
+            end = n + 1 - len(signature)
+            mask &= arr[n:end or None] == byte
+
+        yield from np.flatnonzero(mask).tolist()
+        return
+
+    pos = 0
+    while True:
+        i = buffer.find(signature, pos)
+        if i < 0:
+            break
+        yield i
+        pos = i + 1
+
 
-def get_mscx_filename(archive):
-    """Return the mscx file name stored inside the archive, if available."""
+def get_mscx_filename(buffer, start=0, end=None):
+    """Return the mscx file name stored inside the archive, if available.
+
+    The archive is read in place from buffer[start:end], so the caller
+    can pass a whole chunk without slicing the archive bytes out of it;
+    only the file name itself is copied.
+    """
 
     # The file name is in the second local file header with format: title.mscx
 
+    if end is None:
+        end = len(buffer)
+
     file_name = None
-    for n, lf_m in enumerate(re.finditer(zipfile.stringFileHeader, archive)):
-        if n == 0:
-            # skip the first local file header
-            continue
-        if n == 2:
-            # stop after the second local file header
-            break
 
-        h_start = lf_m.start()
-        h_end = lf_m.start() + zipfile.sizeFileHeader
+    # skip the first local file header, then grab the second one.
+    # bytes.find is much faster than re.finditer for a fixed signature.
+    first = buffer.find(_SIG_FH, start, end)
+    if first >= 0:
+        h_start = buffer.find(_SIG_FH, first + 1, end)
+        if h_start >= 0 and h_start + _SIZE_FH <= end:
+            h_end = h_start + _SIZE_FH
 
-        buffer = archive[h_start:h_end]
-        lf = struct.unpack(zipfile.structFileHeader, buffer)
+            lf = _FH.unpack_from(buffer, h_start)
 
-        file_name = archive[h_end:h_end + lf[zipfile._FH_FILENAME_LENGTH]]
+            name_end = min(h_end + lf[_FH_FILENAME_LENGTH], end)
+            file_name = buffer[h_end:name_end]
 
     try:
         file_name = file_name.decode('utf-8')
@@ -69,34 +203,80 @@ def get_mscx_filename(archive):
     return file_name
 
 
+# trailing counter in a file name stem, e.g. 'title_(3)'
+_COUNTER_RE = re.compile(r'_\((\d+)\)$')
+
+
 def get_safe_to_save_path(path):
     """Return a path that doesn't overwrite any other existing file."""
     if not path.is_file():
         return path
 
-    # add counter '_(1)' in file name stem or increment counter by 1
-    sub_stem = re.sub(
-        r'(?<=_\()\d+(?=\))',
-        lambda m: str(int(m.group(0)) + 1),
-        path.stem
-    )
+    # add counter '_(1)' in file name stem or increment counter until the
+    # name is free
+    m = _COUNTER_RE.search(path.stem)
 
-    if sub_stem == path.stem:
-        new_stem = path.stem + '_(1)'
+    if m:
+        stem = path.stem[:m.start()]
+        n = int(m.group(1)) + 1
     else:
-        new_stem = sub_stem
+        stem = path.stem
+        n = 1
+
+    while (new_path := path.with_stem(f'{stem}_({n})')).is_file():
+        n += 1
+
+    return new_path
+
+
+# BLKGETSIZE64: size in bytes of a block device, as an unsigned 64 bit
+_BLKGETSIZE64 = 0x80081272
+
+_PAGE_SIZE = 4096
+
+_DEFAULT_CHUNK_SIZE = int(16e6)
 
-    return get_safe_to_save_path(path.with_stem(new_stem))
+
+def get_tuned_chunk_size(disk_path):
+    """Return a chunk size in bytes tuned to the device's readahead.
+
+    Chunks several times the kernel readahead window keep the device
+    streaming sequentially; when the readahead can't be read (not Linux,
+    not a block device) the default chunk size is returned.
+    """
+    chunk_size = _DEFAULT_CHUNK_SIZE
+
+    try:
+        rdev = os.stat(disk_path).st_rdev
+        sys_path = Path(f'/sys/dev/block/{os.major(rdev)}:{os.minor(rdev)}')
+
+        # partitions keep the queue attributes on their parent disk
+        for queue in (sys_path / 'queue', sys_path / '..' / 'queue'):
+            read_ahead_path = queue / 'read_ahead_kb'
+            if read_ahead_path.is_file():
+                read_ahead = int(read_ahead_path.read_text()) * 1024
+                chunk_size = max(8 * 1024 * 1024, 4 * read_ahead)
+                break
+    except OSError:
+        pass
+
+    return chunk_size
 
 
 def get_disk_size(disk_path):
     """Return the size of a disk (e.g. /dev/sbd1) in bytes."""
-    result = subprocess.run(['/usr/bin/df', '--all'], capture_output=True)
-    for line in result.stdout.decode('utf-8').split('\n'):
-        fs, _ = line.split(maxsplit=1)
-        if fs == str(disk_path):
-            fs, blocks, used, avail, perc, mnt = line.split()
-            return int(blocks) * 1024
+    fd = os.open(disk_path, os.O_RDONLY)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+
+        if size == 0 and fcntl is not None:
+            # some devices report 0 through lseek, ask the driver directly
+            buffer = fcntl.ioctl(fd, _BLKGETSIZE64, b'\0' * 8)
+            size = struct.unpack('Q', buffer)[0]
+
+        return size
+    finally:
+        os.close(fd)
 
 
 def human_readable_size(size, power=2):
@@ -107,23 +287,33 @@ def human_readable_size(size, power=2):
         10: ['B', 'KB', 'MB', 'GB', 'TB'],
     }
 
-    kilo = {
-        2: 1024,
-        10: 1000
-    }
-
-    for unit, decimal_places in zip(units[power], [0, 0, 1, 1, 1]):
-        if size < kilo[power]:
-            break
+    decimal_places = [0, 0, 1, 1, 1]
 
-        size /= kilo[power]
+    # compute the unit directly from the magnitude, no divide loop
+    if power == 2:
+        index = min((size.bit_length() - 1) // 10, 4) if size else 0
+        size /= 1 << (index * 10)
+    else:
+        index = min(int(math.log10(size)) // 3, 4) if size >= 1000 else 0
+        size /= 10 ** (index * 3)
 
-    return f'{size:.{decimal_places}f}{unit}'
+    return f'{size:.{decimal_places[index]}f}{units[power][index]}'
 
 
 @contextmanager
 def pbar(total, width=30):
+    last = 0.0
+
     def bar(current, msg=''):
+        nonlocal last
+
+        # redrawing costs a write syscall; cap it at ~30 Hz, always
+        # letting the final update through
+        now = time.monotonic()
+        if now - last < 0.033 and current < total:
+            return
+        last = now
+
         progress = current / total
         fill = '=' * int((width - 2) * progress)
         perc = round(progress * 100)
@@ -137,7 +327,9 @@ def pbar(total, width=30):
         if msg:
             out = f'{msg} {out}'
 
-        print(out, end='\r')
+        # single buffered write instead of print's piecewise ones
+        sys.stdout.write(out + '\r')
+        sys.stdout.flush()
 
     try:
         yield bar
@@ -145,17 +337,207 @@ def pbar(total, width=30):
         print()
 
 
+# per-process cache of open input files for the scan workers
+_scan_fds = {}
+
+
+def _get_scan_fd(path):
+    fd = _scan_fds.get(path)
+    if fd is None:
+        fd = os.open(path, os.O_RDONLY)
+        if hasattr(os, 'posix_fadvise'):
+            # tell the kernel we'll stream through the input, so it can
+            # prefetch aggressively
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        _scan_fds[path] = fd
+    return fd
+
+
+def scan_chunk(path, chunk_start, chunk_size, overlap):
+    """Scan one chunk of the input and return the .mscz archives found.
+
+    The first `overlap` bytes of the chunk are shared with the previous
+    chunk, so records fully visible there are skipped to avoid reporting
+    them twice.
+
+    Return a (chunk_length, found) tuple, where found is a list of
+    (end_offset, archive_size, file_name, archive) tuples.
+    """
+    fd = _get_scan_fd(path)
+
+    # offset-addressed read: no shared file position to mutate, which
+    # keeps the kernel prefetch going across candidates
+    chunk = os.pread(fd, chunk_size, chunk_start)
+
+    found = []
+    for m_start in find_signature(chunk, _SIG_ECD):
+
+        ecd_end = m_start + _SIZE_ECD
+
+        if ecd_end > len(chunk):
+            # the record straddles the chunk boundary, the next chunk's
+            # overlap will cover it (at EOF it is truncated anyway)
+            continue
+
+        if ecd_end <= overlap:
+            # already fully visible in the previous chunk
+            continue
+
+        # decode and validate the record in place, no need to re-read it
+        archive_size = verify_ecd(chunk, m_start)
+        if archive_size < 0:
+            continue
+
+        arch_start = ecd_end - archive_size
+
+        if chunk_start + arch_start < 0:
+            # the archive would start before the beginning of the input,
+            # so this is a false positive
+            continue
+
+        # the archive is read in place from the chunk when it's fully
+        # contained, with a single read as the fallback when it isn't
+        if arch_start >= 0:
+            archive = None
+        else:
+            archive = os.pread(fd, archive_size, chunk_start + arch_start)
+
+        # this is too slow
+        # z = zipfile.ZipFile(io.BytesIO(archive))
+        # file_name = z.namelist()[1]
+
+        # this is faster
+        if archive is None:
+            file_name = get_mscx_filename(chunk, arch_start, ecd_end)
+        else:
+            file_name = get_mscx_filename(archive)
+
+        if file_name is None:
+            continue
+
+        if archive is None:
+            # a real find: only now copy the archive bytes out of the chunk
+            archive = chunk[arch_start:ecd_end]
+
+        found.append(
+            (chunk_start + ecd_end, archive_size, file_name, archive)
+        )
+
+    if hasattr(os, 'posix_fadvise'):
+        # the chunk has been processed, keep the page cache from filling
+        # up with data we'll never touch again
+        os.posix_fadvise(fd, chunk_start, len(chunk),
+                         os.POSIX_FADV_DONTNEED)
+
+    return len(chunk), found
+
+
+def scan_chunks(args, chunk_starts, overlap):
+    """Yield (chunk_start, chunk_length, found) for every chunk, in order.
+
+    With more than one job the chunks are scanned by a pool of worker
+    processes, keeping a bounded window of chunks in flight; results are
+    still yielded in input order.
+    """
+    path = args.file_path
+
+    if args.jobs == 1:
+        for n, chunk_start in enumerate(chunk_starts):
+            yield (chunk_start,
+                   *scan_chunk(path, chunk_start, args.chunk_size,
+                               overlap if n else 0))
+        return
+
+    if hasattr(os, 'fork'):
+        # fork workers to avoid the re-import cost of spawning
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = multiprocessing.get_context()
+
+    starts = enumerate(chunk_starts)
+
+    with ProcessPoolExecutor(max_workers=args.jobs,
+                             mp_context=mp_context) as executor:
+
+        def submit_next():
+            for n, chunk_start in starts:
+                pending.append(
+                    (chunk_start,
+                     executor.submit(scan_chunk, path, chunk_start,
+                                     args.chunk_size, overlap if n else 0))
+                )
+                break
+
+        pending = deque()
+        for _ in range(args.jobs * 2):
+            submit_next()
+
+        while pending:
+            chunk_start, future = pending.popleft()
+            chunk_length, found = future.result()
+            submit_next()
+            yield chunk_start, chunk_length, found
+
+
+def save_archive(output_path, in_fd, offset, size, archive):
+    """Write one recovered archive to output_path.
+
+    The archive's on-disk range is known, so the bytes are copied
+    kernel-to-kernel with os.sendfile where supported, never passing
+    through user space; otherwise the in-memory copy is written out.
+    """
+    out_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                     0o666)
+    try:
+        done = 0
+
+        if hasattr(os, 'sendfile'):
+            try:
+                while done < size:
+                    sent = os.sendfile(out_fd, in_fd, offset + done,
+                                       size - done)
+                    if sent == 0:
+                        break
+                    done += sent
+            except OSError:
+                # the input doesn't support sendfile, e.g. a pipe
+                pass
+
+        if done != size:
+            os.lseek(out_fd, 0, os.SEEK_SET)
+            os.ftruncate(out_fd, 0)
+
+            # os.write may write fewer bytes than asked, loop like the
+            # sendfile path so a short write can't truncate the archive
+            view = memoryview(archive)
+            written = 0
+            while written < size:
+                written += os.write(out_fd, view[written:])
+    finally:
+        os.close(out_fd)
+
+
 def main(args):
 
-    # the chunks will have a margin of overlap to make sure that the EOCD
-    # signature is not missed.
+    # consecutive chunks share a margin of overlap to make sure that the
+    # EOCD record is not missed when it straddles a chunk boundary.
     #
-    # technically we don't need twice the length of the signature, but melius
+    # technically we don't need twice the length of the record, but melius
     # abundare quam deficere
-    margin = len(zipfile.stringEndArchive) * 2
+    overlap = _SIZE_ECD * 2
 
-    chunk_start = args.seek
-    chunk_end = None
+    if args.chunk_size is None:
+        if args.disk:
+            args.chunk_size = get_tuned_chunk_size(args.file_path)
+        else:
+            args.chunk_size = _DEFAULT_CHUNK_SIZE
+        log.debug(f'Chunk size: {args.chunk_size}')
+
+    if args.chunk_size <= overlap:
+        # the grid step would be zero or negative and nothing would be
+        # scanned
+        raise SystemExit(f'chunk size must be larger than the chunk '
+                         f'overlap ({overlap} bytes)')
 
     if args.disk:
         file_size = get_disk_size(args.file_path)
@@ -175,81 +557,64 @@ def main(args):
              f'size: {human_readable_size(file_size, 10)}, '
              f'to be parsed: {human_readable_size(parse_size, 10)}')
 
-    with open(args.file_path, 'rb') as f:
-        with pbar(total=parse_size) as bar:
-            while True:
-                if chunk_end is not None:
-                    chunk_start = chunk_end - margin
-
-                msg = f'Reading chunk at {hex(chunk_start)}'
-                log.debug(msg)
-                bar(chunk_start - args.seek, msg=msg)
-
-                f.seek(chunk_start)
-                chunk = f.read(args.chunk_size)
-                chunk_end = f.tell()
-
-                if chunk_end - chunk_start <= margin:
-                    print()
-                    log.info('Reached EOF' + ' ' * 30)
-                    break
-
-                for m in re.finditer(zipfile.stringEndArchive, chunk):
-
-                    # go back to beginning of the header
-                    f.seek(chunk_start + m.start(), os.SEEK_SET)
-
-                    buffer = f.read(zipfile.sizeEndCentDir)
-                    ecd = struct.unpack(zipfile.structEndArchive, buffer)
+    # the chunks form a fixed grid over the parse range; workers pull the
+    # rare archive that starts before their chunk directly with pread, so
+    # a small fixed overlap is enough.
+    #
+    # the grid is aligned to the page size so reads never split pages,
+    # rounding the requested seek down accordingly
+    seek = args.seek & ~(_PAGE_SIZE - 1)
+    parse_size += args.seek - seek
 
-                    # MuseScore files have exactly 3 entries:
-                    # - container.xml
-                    # - title.mscx
-                    # - thumbnail.png
-                    #
-                    # so the following is a quick check
-                    if not (ecd[zipfile._ECD_ENTRIES_THIS_DISK] ==
-                            ecd[zipfile._ECD_ENTRIES_TOTAL] == 3):
-                        continue
+    step = args.chunk_size - overlap
+    if step > _PAGE_SIZE:
+        step &= ~(_PAGE_SIZE - 1)
 
-                    archive_size = (ecd[zipfile._ECD_SIZE] +
-                                    ecd[zipfile._ECD_OFFSET] +
-                                    ecd[zipfile._ECD_COMMENT_SIZE] +
-                                    zipfile.sizeEndCentDir)
+    # aligning the step widens the shared window between consecutive
+    # chunks, so recompute the overlap from it: scan_chunk relies on it to
+    # not report the same record twice
+    overlap = args.chunk_size - step
 
-                    f.seek(-archive_size, os.SEEK_CUR)
+    chunk_starts = range(seek, seek + parse_size, step)
 
-                    # extract the bytes corresponding to the zip archive
-                    archive = f.read(archive_size)
+    # opened before any worker forks, so they all share the same cached fd
+    in_fd = _get_scan_fd(args.file_path)
 
-                    # this is too slow
-                    # z = zipfile.ZipFile(io.BytesIO(archive))
-                    # file_name = z.namelist()[1]
+    with pbar(total=parse_size) as bar:
+        for chunk_start, chunk_length, found in scan_chunks(args,
+                                                            chunk_starts,
+                                                            overlap):
+            msg = f'Reading chunk at {hex(chunk_start)}'
+            log.debug(msg)
+            bar(chunk_start - seek, msg=msg)
 
-                    # this is faster
-                    file_name = get_mscx_filename(archive)
+            for end_offset, archive_size, file_name, archive in found:
+                file_path = Path(file_name)
 
-                    if file_name is not None:
-                        file_path = Path(file_name)
+                if file_path.suffix == '.mscx':
+                    # hurray! we found one!
+                    log.info(f'Found a .ZIP corresponding to a .mscz '
+                             f'file at {hex(end_offset)}, '
+                             f'size: {archive_size} bytes')
 
-                        if file_path.suffix == '.mscx':
-                            # hurray! we found one!
-                            log.info(f'Found a .ZIP corresponding to a .mscz '
-                                     f'file at {hex(f.tell())}, '
-                                     f'size: {archive_size} bytes')
+                    # the actual file suffix is .mscz
+                    # reuse the same stem and change suffix
+                    file_path = file_path.with_suffix('.mscz')
 
-                            # the actual file suffix is .mscz
-                            # reuse the same stem and change suffix
-                            file_path = file_path.with_suffix('.mscz')
+                    output_path = args.output_dir / file_path
 
-                            output_path = args.output_dir / file_path
+                    output_path = get_safe_to_save_path(output_path)
 
-                            output_path = get_safe_to_save_path(output_path)
+                    log.info(f"Saving '{file_path} "
+                             f"file to {output_path}")
+                    save_archive(output_path, in_fd,
+                                 end_offset - archive_size, archive_size,
+                                 archive)
 
-                            log.info(f"Saving '{file_path} "
-                                     f"file to {output_path}")
-                            with open(output_path, 'wb') as out_file:
-                                out_file.write(archive)
+            if chunk_length < args.chunk_size:
+                print()
+                log.info('Reached EOF' + ' ' * 30)
+                break
 
 
 if __name__ == '__main__':
@@ -283,8 +648,8 @@ if __name__ == '__main__':
         '--chunk-size',
         '-c',
         type=int,
-        default=int(16e6),
-        help='chunk size in bytes [default: %(default)s]'
+        help='chunk size in bytes '
+             '[default: tuned to the device readahead, 16000000 baseline]'
     )
     parser.add_argument(
         '--parse-len',
@@ -292,6 +657,13 @@ if __name__ == '__main__':
         type=int,
         help='how many bytes to parse (approximately)'
     )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=os.cpu_count(),
+        help='number of parallel scanning processes [default: %(default)s]'
+    )
     parser.add_argument(
         '--disk',
         action='store_true',